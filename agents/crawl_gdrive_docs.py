@@ -1,40 +1,44 @@
 import os
+import asyncio
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from io import BytesIO
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 from googleapiclient.errors import HttpError
 import io
 import csv
 import sys
 from dataclasses import dataclass
 from datetime import datetime
+from typing import Dict
 from dotenv import load_dotenv
-import openpyxl
-
-from openai import AsyncOpenAI
-from supabase import create_client, Client
 
 from .crawl_pydantic_ai_docs import (
     ProcessedChunk,
     chunk_text,
-    insert_chunk
+    close_http_client,
+    close_pg_pool,
+    get_http_client,
+    insert_chunks_bulk
 )
 
 load_dotenv()
 
-openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-supabase: Client = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_KEY")
-)
-
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 
+DRIVE_DOWNLOAD_URL = 'https://www.googleapis.com/drive/v3/files/{file_id}?alt=media'
+
+# Maximum number of files processed at the same time
+MAX_CONCURRENT_FILES = 8
+
+_token_refresh_lock = asyncio.Lock()
+
 def build_service():
+    """Build a Drive service, returning it with the credentials it uses."""
     creds = None
     token_path = 'credentials/token.json'
     
@@ -53,58 +57,104 @@ def build_service():
         with open(token_path, 'w') as token:
             token.write(creds.to_json())
             
-    return build('drive', 'v3', credentials=creds)
+    return build('drive', 'v3', credentials=creds), creds
 
-async def process_csv_data(file_obj, name: str) -> list[ProcessedChunk]:
-    chunks = []
-    df = pd.read_csv(file_obj)
+def _column_to_strings(column: pd.Series) -> pa.Array:
+    """Convert a dataframe column to an Arrow string array, nulls as "nan"."""
+    if (pd.api.types.is_datetime64_any_dtype(column) or
+            pd.api.types.is_timedelta64_dtype(column) or
+            pd.api.types.is_bool_dtype(column) or
+            pd.api.types.is_float_dtype(column)):
+        # Arrow's cast formats these differently from str() (timestamps gain
+        # a zero fraction, True becomes "true", 2.0 becomes "2"), so keep
+        # pandas' own formatting to match existing chunks
+        return pa.array(column.map(str), type=pa.string())
     
-    # Process each row as a chunk
-    for _, row in df.iterrows():
-        content = "\n".join([f"{col}: {val}" for col, val in row.items()])
-        chunk = ProcessedChunk(
+    try:
+        values = pa.array(column, from_pandas=True).cast(pa.string())
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Mixed-type columns can't be converted directly
+        values = pa.array(column.map(str), type=pa.string())
+    return pc.fill_null(values, "nan")
+
+def dataframe_to_chunks(df: pd.DataFrame, name: str) -> list[ProcessedChunk]:
+    """Turn each row of a dataframe into a "column: value" chunk."""
+    if df.empty:
+        return []
+    
+    # Build every row's content with Arrow string kernels, one column at a time
+    fields = [
+        pc.binary_join_element_wise(f"{col}: ", _column_to_strings(df.iloc[:, i]), "")
+        for i, col in enumerate(df.columns)
+    ]
+    contents = pc.binary_join_element_wise(*fields, "\n")
+    
+    return [
+        ProcessedChunk(
             url=f"gdrive://{name}",
             title=name,
             summary=f"Row from {name}",
             content=content,
             embedding=None
         )
-        chunks.append(chunk)
-        
-    return chunks
+        for content in contents.to_pylist()
+    ]
+
+async def process_csv_data(file_obj, name: str) -> list[ProcessedChunk]:
+    # Arrow's multithreaded C++ parser
+    df = pd.read_csv(file_obj, engine="pyarrow")
+    
+    # Arrow infers timestamps the default parser leaves as text, which would
+    # reformat them, so read those columns again as written
+    date_cols = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])]
+    if date_cols:
+        file_obj.seek(0)
+        df[date_cols] = pd.read_csv(file_obj, usecols=date_cols, dtype=str)[date_cols]
+    
+    # Process each row as a chunk
+    return dataframe_to_chunks(df, name)
 
 async def process_excel_data(file_obj, name: str) -> list[ProcessedChunk]:
-    chunks = []
-    df = pd.read_excel(file_obj)
+    # calamine's Rust parser is much faster than openpyxl for xlsx
+    df = pd.read_excel(file_obj, engine="calamine")
     
     # Process each row as a chunk
-    for _, row in df.iterrows():
-        content = "\n".join([f"{col}: {val}" for col, val in row.items()])
-        chunk = ProcessedChunk(
-            url=f"gdrive://{name}",
-            title=name,
-            summary=f"Row from {name}",
-            content=content,
-            embedding=None
-        )
-        chunks.append(chunk)
-        
-    return chunks
+    return dataframe_to_chunks(df, name)
+
+async def _get_access_token(creds: Credentials) -> str:
+    """Get a valid OAuth access token, refreshing the credentials if needed."""
+    if not creds.valid:
+        # Concurrent downloads share the credentials, so only refresh once
+        async with _token_refresh_lock:
+            if not creds.valid:
+                await asyncio.to_thread(creds.refresh, Request())
+    return creds.token
+
+async def download_file(creds: Credentials, file_id: str) -> BytesIO:
+    """Download a Drive file's contents without blocking the event loop."""
+    token = await _get_access_token(creds)
+    client = get_http_client()
+    
+    file_obj = BytesIO()
+    async with client.stream(
+        "GET",
+        DRIVE_DOWNLOAD_URL.format(file_id=file_id),
+        headers={"Authorization": f"Bearer {token}"}
+    ) as response:
+        response.raise_for_status()
+        async for data in response.aiter_bytes():
+            file_obj.write(data)
+    
+    file_obj.seek(0)
+    return file_obj
 
-async def process_file(service, file: Dict[str, str]):
+async def process_file(creds: Credentials, file: Dict[str, str]):
     file_id = file['id']
     mime_type = file['mimeType']
     name = file['name']
     
     try:
-        request = service.files().get_media(fileId=file_id)
-        file_obj = BytesIO()
-        downloader = MediaIoBaseDownload(file_obj, request)
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-        
-        file_obj.seek(0)
+        file_obj = await download_file(creds, file_id)
         
         # Process based on file type
         if mime_type == 'text/csv':
@@ -116,14 +166,13 @@ async def process_file(service, file: Dict[str, str]):
             return
         
         # Insert chunks into database
-        for chunk in chunks:
-            await insert_chunk(chunk)
+        await insert_chunks_bulk(chunks)
             
     except Exception as e:
         print(f"Error processing file {name}: {e}")
 
 async def process_folder(folder_id: str):
-    service = build_service()
+    service, creds = build_service()
     
     try:
         results = service.files().list(
@@ -133,16 +182,33 @@ async def process_folder(folder_id: str):
         
         files = results.get('files', [])
         
-        for file in files:
-            await process_file(service, file)
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_FILES)
+        
+        async def _guarded(file):
+            async with semaphore:
+                await process_file(creds, file)
+        
+        tasks = [asyncio.create_task(_guarded(file)) for file in files]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        for file, result in zip(files, results):
+            if isinstance(result, Exception):
+                print(f"Error processing file {file['name']}: {result}")
             
     except Exception as e:
         print(f"Error processing folder: {e}")
 
 if __name__ == "__main__":
-    import asyncio
     folder_id = os.getenv('GDRIVE_FOLDER_ID')
     if not folder_id:
         print("Please set GDRIVE_FOLDER_ID environment variable")
         sys.exit(1)
-    asyncio.run(process_folder(folder_id))
\ No newline at end of file
+    
+    async def _main():
+        try:
+            await process_folder(folder_id)
+        finally:
+            await close_http_client()
+            await close_pg_pool()
+    
+    asyncio.run(_main())
\ No newline at end of file
@@ -6,11 +6,22 @@ import os
 import sys
 import logging
 import asyncio
-from typing import List, Optional
+import hashlib
+import sqlite3
+import struct
+import threading
+from functools import lru_cache
+from itertools import accumulate
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
-from bs4 import BeautifulSoup
-import aiohttp
+from urllib.parse import urljoin
+from xml.etree import ElementTree
+from selectolax.lexbor import LexborHTMLParser
+import httpx
+import asyncpg
+from pgvector.utils import from_db_binary, to_db_binary
 from openai import AsyncOpenAI
+from postgrest import AsyncPostgrestClient
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
@@ -23,58 +34,370 @@ class ProcessedChunk:
     content: str
     embedding: Optional[List[float]] = None
 
-# Initialize OpenAI and Supabase clients
 load_dotenv()
-openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-supabase: Client = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_KEY")
-)
+
+# Clients are created on first use so importing the agents stays cheap
+@lru_cache(maxsize=1)
+def get_openai() -> AsyncOpenAI:
+    """Get the shared OpenAI client."""
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+@lru_cache(maxsize=1)
+def get_supabase() -> Client:
+    """Get the shared Supabase client."""
+    return create_client(
+        os.getenv("SUPABASE_URL"),
+        os.getenv("SUPABASE_SERVICE_KEY")
+    )
+
+@lru_cache(maxsize=1)
+def get_postgrest_client() -> AsyncPostgrestClient:
+    """Get the shared async PostgREST client."""
+    key = os.getenv("SUPABASE_SERVICE_KEY")
+    return AsyncPostgrestClient(
+        f"{os.getenv('SUPABASE_URL')}/rest/v1",
+        headers={"apikey": key, "Authorization": f"Bearer {key}"}
+    )
+
+# Connection pool shared by all page fetches
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=50, max_connections=100)
+HTTP_TIMEOUT = httpx.Timeout(30.0)
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create a keep-alive HTTP client for fetching pages."""
+    return httpx.AsyncClient(
+        limits=HTTP_LIMITS,
+        timeout=HTTP_TIMEOUT,
+        follow_redirects=True,
+        http2=True
+    )
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the shared HTTP client for long-running loops, creating it on first use."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = create_http_client()
+    return _http_client
+
+async def close_http_client():
+    """Close the shared HTTP client if it was opened."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+# Embedding backend: "openai" (default) or "local" (sentence-transformers)
+EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "openai")
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+LOCAL_EMBEDDING_BATCH_SIZE = 64
+
+_local_model = None
+_local_model_lock = threading.Lock()
+
+def get_local_model():
+    """Get the local sentence-transformers model, loading it on first use."""
+    global _local_model
+    # Called from worker threads, so concurrent first calls load it only once
+    with _local_model_lock:
+        if _local_model is None:
+            from sentence_transformers import SentenceTransformer
+            # Device defaults to CUDA when available
+            _local_model = SentenceTransformer(
+                LOCAL_EMBEDDING_MODEL,
+                device=os.getenv("LOCAL_EMBEDDING_DEVICE")
+            )
+    return _local_model
+
+def _encode_local(texts: List[str]):
+    """Load the local model if needed and encode texts with it."""
+    return get_local_model().encode(
+        texts,
+        batch_size=LOCAL_EMBEDDING_BATCH_SIZE,
+        show_progress_bar=False,
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    )
+
+async def get_local_embeddings(texts: List[str]) -> List[List[float]]:
+    """Embed texts with the local model without blocking the event loop."""
+    # Loading the model takes seconds, so it happens off the loop too
+    embeddings = await asyncio.to_thread(_encode_local, texts)
+    return embeddings.tolist()
 
 async def get_embedding(text: str) -> List[float]:
     """Get an embedding for a piece of text."""
-    response = await openai_client.embeddings.create(
+    if EMBEDDINGS_BACKEND == "local":
+        return (await get_local_embeddings([text]))[0]
+    
+    response = await get_openai().embeddings.create(
         model="text-embedding-ada-002",
         input=text
     )
     return response.data[0].embedding
 
+# Limits for a single embeddings request
+EMBEDDING_BATCH_SIZE = 96
+EMBEDDING_BATCH_TOKENS = 250_000
+
+# Maximum number of embeddings/insert requests in flight at the same time
+MAX_CONCURRENT_REQUESTS = 10
+_embedding_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+_insert_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+def _estimate_tokens(text: str) -> int:
+    """Rough token count for a piece of text (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+async def get_embeddings_batch(texts: List[str]) -> List[List[float]]:
+    """Get embeddings for many texts using as few requests as possible."""
+    if EMBEDDINGS_BACKEND == "local":
+        return await get_local_embeddings(texts)
+    
+    embeddings: List[Optional[List[float]]] = [None] * len(texts)
+    
+    # Sort by length so similarly sized texts are packed together
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    
+    batches: List[List[int]] = [[]]
+    batch_tokens = 0
+    for i in order:
+        tokens = _estimate_tokens(texts[i])
+        batch = batches[-1]
+        if batch and (len(batch) >= EMBEDDING_BATCH_SIZE or
+                      batch_tokens + tokens > EMBEDDING_BATCH_TOKENS):
+            batches.append([])
+            batch_tokens = 0
+        batches[-1].append(i)
+        batch_tokens += tokens
+    
+    # Send the requests concurrently, bounded across all callers
+    await asyncio.gather(*(
+        _embed_batch(texts, batch, embeddings) for batch in batches if batch
+    ))
+    
+    return embeddings
+
+async def _embed_batch(texts: List[str], batch: List[int], embeddings: List[Optional[List[float]]]):
+    """Embed the texts at the given indices and store the results in place."""
+    async with _embedding_semaphore:
+        response = await get_openai().embeddings.create(
+            model="text-embedding-ada-002",
+            input=[texts[i] for i in batch]
+        )
+    for i, data in zip(batch, response.data):
+        embeddings[i] = data.embedding
+
+# Local cache of embeddings keyed by a hash of the model and chunk content
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embed_cache.db")
+EMBEDDING_CACHE_LOOKUP_SIZE = 500
+
+_embedding_cache: Optional[sqlite3.Connection] = None
+# The cache is used from worker threads; one query runs on it at a time
+_embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> sqlite3.Connection:
+    """Get the embedding cache database, creating it on first use."""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = sqlite3.connect(EMBEDDING_CACHE_PATH, check_same_thread=False)
+        _embedding_cache.execute(
+            "CREATE TABLE IF NOT EXISTS cache (h BLOB PRIMARY KEY, emb BLOB)"
+        )
+    return _embedding_cache
+
+def _content_hash(text: str) -> bytes:
+    """Hash chunk content together with the model that embeds it."""
+    model = LOCAL_EMBEDDING_MODEL if EMBEDDINGS_BACKEND == "local" else "text-embedding-ada-002"
+    return hashlib.blake2b(f"{model}\0{text}".encode(), digest_size=16).digest()
+
+def _cache_lookup(hashes: List[bytes]) -> Dict[bytes, List[float]]:
+    """Look up cached embeddings, returning only the hits."""
+    hits = {}
+    with _embedding_cache_lock:
+        cache = get_embedding_cache()
+        for i in range(0, len(hashes), EMBEDDING_CACHE_LOOKUP_SIZE):
+            batch = hashes[i:i + EMBEDDING_CACHE_LOOKUP_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = cache.execute(f"SELECT h, emb FROM cache WHERE h IN ({placeholders})", batch)
+            for h, blob in rows:
+                # Stored as half-precision floats
+                hits[h] = list(struct.unpack(f"{len(blob) // 2}e", blob))
+    return hits
+
+def _cache_store(entries: List[Tuple[bytes, List[float]]]):
+    """Write new embeddings to the cache."""
+    rows = [(h, struct.pack(f"{len(embedding)}e", *embedding)) for h, embedding in entries]
+    with _embedding_cache_lock:
+        cache = get_embedding_cache()
+        with cache:
+            cache.executemany("INSERT OR REPLACE INTO cache (h, emb) VALUES (?, ?)", rows)
+
+async def embed_chunks(chunks: List[ProcessedChunk]):
+    """Fill in missing embeddings for a list of chunks in batched requests."""
+    pending = [chunk for chunk in chunks if not chunk.embedding]
+    if not pending:
+        return
+    
+    # Reuse cached embeddings and only send unseen content to the backend
+    hashes = [_content_hash(chunk.content) for chunk in pending]
+    # sqlite is synchronous, so keep its queries and commits off the event loop
+    cached = await asyncio.to_thread(_cache_lookup, hashes)
+    misses: Dict[bytes, List[ProcessedChunk]] = {}
+    for chunk, h in zip(pending, hashes):
+        if h in cached:
+            chunk.embedding = cached[h]
+        else:
+            misses.setdefault(h, []).append(chunk)
+    if not misses:
+        return
+    
+    embeddings = await get_embeddings_batch([same[0].content for same in misses.values()])
+    for same, embedding in zip(misses.values(), embeddings):
+        for chunk in same:
+            chunk.embedding = embedding
+    await asyncio.to_thread(_cache_store, list(zip(misses.keys(), embeddings)))
+
 async def chunk_text(text: str, url: str, title: str) -> List[ProcessedChunk]:
     """Split text into chunks with some overlap."""
     words = text.split()
     chunk_size = 1000
     overlap = 100
-    chunks = []
     
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk_words = words[i:i + chunk_size]
-        chunk_text = " ".join(chunk_words)
-        
-        chunks.append(ProcessedChunk(
+    # Join once and slice chunks out by character offset instead of
+    # re-joining the words of every chunk
+    normalized = " ".join(words)
+    word_ends = list(accumulate(len(word) + 1 for word in words))
+    
+    starts = range(0, len(words), chunk_size - overlap)
+    bounds = [
+        (word_ends[i - 1] if i else 0, word_ends[min(i + chunk_size, len(words)) - 1] - 1)
+        for i in starts
+    ]
+    
+    return [
+        ProcessedChunk(
             url=url,
             title=title,
-            summary=f"Part {len(chunks) + 1} of {title}",
-            content=chunk_text
-        ))
-    
-    return chunks
+            summary=f"Part {n + 1} of {title}",
+            content=normalized[start:end]
+        )
+        for n, (start, end) in enumerate(bounds)
+    ]
 
 async def insert_chunk(chunk: ProcessedChunk):
     """Insert a processed chunk into the database."""
     if not chunk.embedding:
         chunk.embedding = await get_embedding(chunk.content)
     
-    data = {
+    data = _chunk_row(chunk)
+    
+    result = await get_postgrest_client().from_("site_pages").insert(data).execute()
+    return result
+
+# Maximum number of rows sent to PostgREST in a single insert
+INSERT_BATCH_SIZE = 1000
+
+# Decimal places kept for stored embedding values. Embeddings are unit
+# length, so this keeps about half-precision accuracy while cutting the
+# JSON payload for each vector by more than half.
+EMBEDDING_DECIMALS = 5
+
+def quantize_embedding(embedding: List[float]) -> List[float]:
+    """Round an embedding to the precision it is stored at."""
+    return [round(value, EMBEDDING_DECIMALS) for value in embedding]
+
+def _chunk_row(chunk: ProcessedChunk) -> dict:
+    """Build the site_pages row for a processed chunk."""
+    return {
         "url": chunk.url,
         "title": chunk.title,
         "summary": chunk.summary,
         "content": chunk.content,
-        "embedding": chunk.embedding,
+        "embedding": quantize_embedding(chunk.embedding),
         "source": "pydantic_ai_docs"
     }
+
+# Direct Postgres connection used for COPY-based ingest when set
+SUPABASE_DB_URL = os.getenv("SUPABASE_DB_URL")
+SITE_PAGES_COLUMNS = ["url", "title", "summary", "content", "embedding", "source"]
+
+_pg_pool: Optional[asyncpg.Pool] = None
+_pg_pool_lock = asyncio.Lock()
+
+# Schema holding the pgvector type; looked up when not set. Supabase installs
+# extensions into the "extensions" schema rather than "public".
+PGVECTOR_SCHEMA = os.getenv("PGVECTOR_SCHEMA")
+
+async def _init_pg_connection(conn: asyncpg.Connection):
+    """Register the pgvector codec so embeddings can be copied in binary."""
+    schema = PGVECTOR_SCHEMA or await conn.fetchval(
+        "SELECT n.nspname FROM pg_type t "
+        "JOIN pg_namespace n ON n.oid = t.typnamespace "
+        "WHERE t.typname = 'vector'"
+    )
+    if schema is None:
+        raise RuntimeError("pgvector type 'vector' not found in the database")
     
-    result = supabase.table("site_pages").insert(data).execute()
-    return result
+    await conn.set_type_codec(
+        "vector",
+        schema=schema,
+        encoder=to_db_binary,
+        decoder=from_db_binary,
+        format="binary"
+    )
+
+async def get_pg_pool() -> asyncpg.Pool:
+    """Get the shared Postgres connection pool, creating it on first use."""
+    global _pg_pool
+    async with _pg_pool_lock:
+        if _pg_pool is None:
+            _pg_pool = await asyncpg.create_pool(
+                SUPABASE_DB_URL,
+                min_size=2,
+                max_size=8,
+                init=_init_pg_connection
+            )
+    return _pg_pool
+
+async def close_pg_pool():
+    """Close the shared Postgres connection pool if it was opened."""
+    global _pg_pool
+    async with _pg_pool_lock:
+        if _pg_pool is not None:
+            await _pg_pool.close()
+            _pg_pool = None
+
+async def insert_chunks_bulk(chunks: List[ProcessedChunk]):
+    """Insert many processed chunks into the database in batched requests."""
+    await embed_chunks(chunks)
+    
+    rows = [_chunk_row(chunk) for chunk in chunks]
+    if not rows:
+        return
+    
+    if SUPABASE_DB_URL:
+        # COPY straight into Postgres, skipping PostgREST and JSON entirely
+        pool = await get_pg_pool()
+        records = [tuple(row[column] for column in SITE_PAGES_COLUMNS) for row in rows]
+        async with pool.acquire() as conn:
+            await conn.copy_records_to_table(
+                "site_pages",
+                records=records,
+                columns=SITE_PAGES_COLUMNS
+            )
+        return
+    
+    await asyncio.gather(*(
+        _insert_rows(rows[i:i + INSERT_BATCH_SIZE])
+        for i in range(0, len(rows), INSERT_BATCH_SIZE)
+    ))
+
+async def _insert_rows(rows: List[dict]):
+    """Insert one batch of rows through PostgREST."""
+    async with _insert_semaphore:
+        await get_postgrest_client().from_("site_pages").insert(rows).execute()
 
 async def process_chunk(chunk: ProcessedChunk, url: str):
     """Process and store a single chunk."""
@@ -84,52 +407,99 @@ async def process_chunk(chunk: ProcessedChunk, url: str):
     except Exception as e:
         logging.error(f"Error processing chunk from {url}: {e}")
 
-async def crawl_page(url: str, session: aiohttp.ClientSession) -> List[ProcessedChunk]:
+async def crawl_page(url: str, client: httpx.AsyncClient) -> List[ProcessedChunk]:
     """Crawl a single documentation page."""
     try:
-        async with session.get(url) as response:
-            if response.status != 200:
-                logging.error(f"Error fetching {url}: {response.status}")
-                return []
-            
-            html = await response.text()
-            soup = BeautifulSoup(html, 'html.parser')
-            
-            # Extract main content
-            main_content = soup.find('main')
-            if not main_content:
-                logging.warning(f"No main content found at {url}")
-                return []
-            
-            # Get title
-            title = soup.find('h1')
-            title_text = title.get_text() if title else url
-            
-            # Process content
-            content = main_content.get_text()
-            chunks = await chunk_text(content, url, title_text)
-            
-            return chunks
-            
+        response = await client.get(url)
+        if response.status_code != 200:
+            logging.error(f"Error fetching {url}: {response.status_code}")
+            return []
+        
+        html = response.text
+        tree = LexborHTMLParser(html)
+        
+        # Extract main content
+        main_content = tree.css_first('main')
+        if not main_content:
+            logging.warning(f"No main content found at {url}")
+            return []
+        
+        # Get title
+        title = tree.css_first('h1')
+        title_text = title.text() if title else url
+        
+        # Process content, leaving out inline scripts and styles
+        main_content.strip_tags(["script", "style"])
+        content = main_content.text()
+        chunks = await chunk_text(content, url, title_text)
+        await embed_chunks(chunks)
+        
+        return chunks
+        
     except Exception as e:
         logging.error(f"Error crawling {url}: {e}")
         return []
 
+async def get_doc_urls(base_url: str, client: httpx.AsyncClient) -> List[str]:
+    """Get the documentation page URLs listed in the site's sitemap."""
+    # The page-level sitemap lives next to the docs, not at the domain root
+    sitemap_url = urljoin(base_url, "sitemap.xml")
+    urls = await _read_sitemap(sitemap_url, base_url, client)
+    if not urls:
+        logging.warning(f"No pages found in {sitemap_url}, crawling only {base_url}")
+        return [base_url]
+    return urls
+
+async def _read_sitemap(sitemap_url: str, base_url: str, client: httpx.AsyncClient) -> List[str]:
+    """Read the URLs under base_url from a sitemap, or none if it can't be read."""
+    try:
+        response = await client.get(sitemap_url)
+        if response.status_code != 200:
+            logging.error(f"Error fetching {sitemap_url}: {response.status_code}")
+            return []
+        
+        root = ElementTree.fromstring(response.text)
+        namespace = {"sm": "http://www.sitemaps.org/schemas/sitemap/0.9"}
+        urls = [loc.text.strip() for loc in root.findall(".//sm:loc", namespace) if loc.text]
+        return [url for url in urls if url.startswith(base_url)]
+        
+    except Exception as e:
+        logging.error(f"Error fetching sitemap {sitemap_url}: {e}")
+        return []
+
+async def crawl_and_store(url: str, client: httpx.AsyncClient, semaphore: asyncio.Semaphore):
+    """Crawl a page and store its chunks, bounded by the given semaphore."""
+    async with semaphore:
+        chunks = await crawl_page(url, client)
+        
+        # Store all chunks for the page at once
+        await insert_chunks_bulk(chunks)
+        logging.info(f"Processed {len(chunks)} chunks from {url}")
+
+# Maximum number of pages crawled at the same time
+MAX_CONCURRENT_PAGES = 8
+
 async def main():
     """Main crawling function."""
     base_url = "https://pydantic-ai.readthedocs.io/en/latest/"
     
-    async with aiohttp.ClientSession() as session:
-        # Start with the main page
-        chunks = await crawl_page(base_url, session)
-        
-        # Process chunks
-        tasks = []
-        for chunk in chunks:
-            task = asyncio.create_task(process_chunk(chunk, base_url))
-            tasks.append(task)
-        
-        await asyncio.gather(*tasks)
+    try:
+        async with create_http_client() as client:
+            urls = await get_doc_urls(base_url, client)
+            logging.info(f"Found {len(urls)} pages to crawl")
+            
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_PAGES)
+            tasks = [
+                asyncio.create_task(crawl_and_store(url, client, semaphore))
+                for url in urls
+            ]
+            
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            for url, result in zip(urls, results):
+                if isinstance(result, Exception):
+                    logging.error(f"Error processing chunks from {url}: {result}")
+    finally:
+        await close_pg_pool()
 
 if __name__ == "__main__":
     # Set up logging
@@ -155,8 +525,19 @@ __all__ = [
     'ProcessedChunk',
     'chunk_text',
     'insert_chunk',
+    'insert_chunks_bulk',
+    'close_pg_pool',
     'process_chunk',
     'get_embedding',
+    'get_openai',
+    'get_supabase',
+    'create_http_client',
+    'get_http_client',
+    'close_http_client',
+    'get_postgrest_client',
+    'get_embeddings_batch',
+    'embed_chunks',
+    'quantize_embedding',
 ]
 
 # Rename main to crawl_pydantic_ai_docs for better clarity
@@ -1,5 +1,5 @@
 import os
-import json
+import orjson
 import asyncio
 from datetime import datetime
 from typing import Dict, List, Optional
@@ -9,26 +9,61 @@ from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 
 from .crawl_gdrive_docs import process_file
+from .crawl_pydantic_ai_docs import close_http_client, close_pg_pool
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 FOLDER_ID = os.getenv('GDRIVE_FOLDER_ID')
+PROCESSED_FILES_PATH = 'processed_files.json'
+PAGE_TOKEN_PATH = 'drive_page_token.txt'
+
+# Poll every minute, backing off exponentially up to an hour on errors
+POLL_INTERVAL = 60
+MAX_POLL_INTERVAL = 3600
+
+CHANGE_FIELDS = (
+    "nextPageToken,newStartPageToken,"
+    "changes(fileId,removed,file(id,name,mimeType,modifiedTime,parents,trashed))"
+)
+
+def _write_atomic(path: str, data: bytes):
+    # Write to a temporary file and swap it in so a crash never leaves
+    # a half-written state file behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
 
 class DriveWatcher:
     def __init__(self):
         self.processed_files: Dict[str, str] = {}
+        self.page_token: Optional[str] = None
+        self.service = None
+        self.creds = None
         self.load_processed_files()
+        self.load_page_token()
         
     def load_processed_files(self):
         try:
-            with open('processed_files.json', 'r') as f:
-                self.processed_files = json.load(f)
+            with open(PROCESSED_FILES_PATH, 'rb') as f:
+                self.processed_files = orjson.loads(f.read())
         except FileNotFoundError:
             self.processed_files = {}
+        self._dirty = False
             
     def save_processed_files(self):
-        with open('processed_files.json', 'w') as f:
-            json.dump(self.processed_files, f)
+        _write_atomic(PROCESSED_FILES_PATH, orjson.dumps(self.processed_files))
+        self._dirty = False
+        
+    def load_page_token(self):
+        try:
+            with open(PAGE_TOKEN_PATH, 'r') as f:
+                self.page_token = f.read().strip() or None
+        except FileNotFoundError:
+            self.page_token = None
+            
+    def save_page_token(self):
+        _write_atomic(PAGE_TOKEN_PATH, self.page_token.encode())
             
     def get_credentials(self):
         creds = None
@@ -51,42 +86,107 @@ class DriveWatcher:
                 
         return creds
     
-    async def check_for_changes(self):
+    async def check_for_changes(self) -> bool:
+        """Process what changed since the last poll, returning whether it succeeded."""
+        next_token = None
         try:
-            service = build('drive', 'v3', credentials=self.get_credentials())
+            # Reuse the Drive client across polls rather than rebuilding it
+            if self.service is None:
+                self.creds = self.get_credentials()
+                self.service = build('drive', 'v3', credentials=self.creds)
+            service = self.service
+            
+            if self.page_token is None:
+                # Take the token first so changes made during the scan are
+                # picked up by the next poll
+                start_token = service.changes().getStartPageToken().execute()['startPageToken']
+                await self.scan_folder(service)
+                next_token = start_token
+            else:
+                next_token = await self.process_changes(service, self.page_token)
+            return True
+                
+        except Exception as e:
+            print(f"Error checking for changes: {e}")
+            return False
+        
+        finally:
+            # Persist everything processed this poll in a single write,
+            # before the token that marks it as done
+            if self._dirty:
+                self.save_processed_files()
+            if next_token is not None and next_token != self.page_token:
+                self.page_token = next_token
+                self.save_page_token()
+        
+    async def scan_folder(self, service):
+        """Reconcile processed files against a full listing of the folder."""
+        results = service.files().list(
+            q=f"'{FOLDER_ID}' in parents and trashed = false",
+            fields="files(id, name, mimeType, modifiedTime)"
+        ).execute()
+        
+        current_files = results.get('files', [])
+        
+        for file in current_files:
+            await self.process_if_modified(file)
+        
+        stored_ids = set(self.processed_files.keys())
+        current_ids = {f['id'] for f in current_files}
+        deleted_ids = stored_ids - current_ids
+        
+        for file_id in deleted_ids:
+            self.mark_deleted(file_id)
             
-            results = service.files().list(
-                q=f"'{FOLDER_ID}' in parents",
-                fields="files(id, name, mimeType, modifiedTime)"
+    async def process_changes(self, service, page_token: str) -> str:
+        """Handle the changes listed since page_token and return the next start token."""
+        while True:
+            response = service.changes().list(
+                pageToken=page_token,
+                fields=CHANGE_FIELDS
             ).execute()
             
-            current_files = results.get('files', [])
+            for change in response.get('changes', []):
+                file = change.get('file')
+                if (change.get('removed') or not file or file.get('trashed') or
+                        FOLDER_ID not in file.get('parents', [])):
+                    # Deleted, trashed or moved out of the watched folder
+                    if change['fileId'] in self.processed_files:
+                        self.mark_deleted(change['fileId'])
+                    continue
+                await self.process_if_modified(file)
             
-            for file in current_files:
-                file_id = file['id']
-                modified_time = file['modifiedTime']
-                
-                if (file_id not in self.processed_files or 
-                    self.processed_files[file_id] != modified_time):
-                    print(f"\nProcessing file: {file['name']}")
-                    await process_file(service, file)
-                    self.processed_files[file_id] = modified_time
-                    self.save_processed_files()
+            if 'newStartPageToken' in response:
+                return response['newStartPageToken']
+            page_token = response['nextPageToken']
             
-            stored_ids = set(self.processed_files.keys())
-            current_ids = {f['id'] for f in current_files}
-            deleted_ids = stored_ids - current_ids
+    async def process_if_modified(self, file: Dict[str, str]):
+        file_id = file['id']
+        modified_time = file['modifiedTime']
+        
+        if (file_id not in self.processed_files or 
+            self.processed_files[file_id] != modified_time):
+            print(f"\nProcessing file: {file['name']}")
+            await process_file(self.creds, file)
+            self.processed_files[file_id] = modified_time
+            self._dirty = True
             
-            for file_id in deleted_ids:
-                print(f"File {file_id} was deleted")
-                del self.processed_files[file_id]
-                self.save_processed_files()
-                
-        except Exception as e:
-            print(f"Error checking for changes: {e}")
+    def mark_deleted(self, file_id: str):
+        print(f"File {file_id} was deleted")
+        del self.processed_files[file_id]
+        self._dirty = True
             
     async def start(self):
         print("Starting Drive Watcher...")
-        while True:
-            await self.check_for_changes()
-            await asyncio.sleep(60)  # Check every minute
\ No newline at end of file
+        interval = POLL_INTERVAL
+        try:
+            while True:
+                if await self.check_for_changes():
+                    interval = POLL_INTERVAL
+                else:
+                    interval = min(interval * 2, MAX_POLL_INTERVAL)
+                await asyncio.sleep(interval)
+        finally:
+            # Release the shared download client and Postgres pool on shutdown
+            await close_http_client()
+            await close_pg_pool()
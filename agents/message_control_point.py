@@ -10,6 +10,8 @@ from typing import Dict, Any, Callable, List, Set
 import asyncio
 import logging
 
+logger = logging.getLogger(__name__)
+
 @dataclass
 class MessageControlPoint:
     """
@@ -27,35 +29,43 @@ class MessageControlPoint:
     subscribers: Set[str] = field(default_factory=set)
 
     async def publish(self, topic: str, message: Any):
-        """Publish a message to a specific topic."""
-        if topic in self.handlers:
-            await self.queue.put((topic, message))
-            logging.debug(f"MCP {self.name} published message to {topic}")
+        """
+        Publish a message to a specific topic.
+        
+        The topic's handler is resolved here and queued with the message, so
+        a message is delivered to the handler subscribed when it was published.
+        """
+        handler = self.handlers.get(topic)
+        if handler is not None:
+            await self.queue.put((topic, handler, message))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("MCP %s published message to %s", self.name, topic)
 
     async def subscribe(self, topic: str, handler: Callable):
         """Subscribe to a topic with a handler function."""
         self.handlers[topic] = handler
         self.subscribers.add(topic)
-        logging.debug(f"MCP {self.name} subscribed to {topic}")
+        logger.debug("MCP %s subscribed to %s", self.name, topic)
 
     async def unsubscribe(self, topic: str):
         """Unsubscribe from a topic."""
         if topic in self.handlers:
             del self.handlers[topic]
         self.subscribers.discard(topic)
-        logging.debug(f"MCP {self.name} unsubscribed from {topic}")
+        logger.debug("MCP %s unsubscribed from %s", self.name, topic)
 
     async def start(self):
         """Start processing messages from the queue."""
-        logging.info(f"MCP {self.name} started")
+        logger.info("MCP %s started", self.name)
+        get = self.queue.get
+        task_done = self.queue.task_done
         while True:
-            topic, message = await self.queue.get()
-            if topic in self.handlers:
-                try:
-                    await self.handlers[topic](message)
-                except Exception as e:
-                    logging.error(f"Error in MCP {self.name} handling {topic}: {e}")
-            self.queue.task_done()
+            topic, handler, message = await get()
+            try:
+                await handler(message)
+            except Exception as e:
+                logger.error("Error in MCP %s handling %s: %s", self.name, topic, e)
+            task_done()
 
 # Global registry of MCPs
 mcp_registry: Dict[str, MessageControlPoint] = {}
\ No newline at end of file
@@ -3,12 +3,23 @@ RAG expert agent for handling queries about Pydantic AI and business data.
 """
 
 import os
+import asyncio
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import List, Dict, Any, Optional
+import numpy as np
 from openai import AsyncOpenAI
-from supabase import create_client, Client
+from supabase import Client
 from dotenv import load_dotenv
 
+from .crawl_pydantic_ai_docs import (
+    get_embedding,
+    get_openai,
+    get_postgrest_client,
+    get_supabase
+)
+
 @dataclass
 class PydanticAIDeps:
     """Dependencies for the Pydantic AI expert."""
@@ -17,17 +28,13 @@ class PydanticAIDeps:
 
 load_dotenv()
 
-# Initialize clients
-openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-supabase: Client = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_KEY")
-)
-
-deps = PydanticAIDeps(
-    supabase=supabase,
-    openai_client=openai_client
-)
+@lru_cache(maxsize=1)
+def get_deps() -> PydanticAIDeps:
+    """Get the expert's dependencies, creating the clients on first use."""
+    return PydanticAIDeps(
+        supabase=get_supabase(),
+        openai_client=get_openai()
+    )
 
 async def preprocess_query(query: str) -> str:
     """Extract key technical concepts from the query."""
@@ -37,7 +44,7 @@ async def preprocess_query(query: str) -> str:
     Return these concepts in a comma-separated list.
     """
     
-    response = await openai_client.chat.completions.create(
+    response = await get_openai().chat.completions.create(
         model=os.getenv("LLM_MODEL", "gpt-4"),
         messages=[
             {"role": "system", "content": system_prompt},
@@ -49,26 +56,127 @@ async def preprocess_query(query: str) -> str:
     concepts = response.choices[0].message.content
     return f"{query} {concepts}"
 
+# Number of documents retrieved as context for a query
+MATCH_COUNT = 5
+
+# Search result caching
+SEARCH_CACHE_SIZE = 256
+SEMANTIC_CACHE_THRESHOLD = 0.97
+
+class LRUCache:
+    """A small least-recently-used cache."""
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: OrderedDict = OrderedDict()
+    
+    def get(self, key) -> Optional[Any]:
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+    
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+class SemanticCache:
+    """Search results looked up by cosine similarity of the query embedding."""
+    
+    def __init__(self, max_size: int, threshold: float):
+        self.max_size = max_size
+        self.threshold = threshold
+        # One row per slot, allocated once the embedding size is known
+        self._vectors: Optional[np.ndarray] = None
+        self._source_ids = np.full(max_size, -1, dtype=np.int32)
+        self._results: List[Optional[List[Dict[str, Any]]]] = [None] * max_size
+        self._sources: Dict[Optional[str], int] = {}
+        self._lru: OrderedDict = OrderedDict()
+    
+    def get(self, embedding: List[float], source: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        source_id = self._sources.get(source)
+        if self._vectors is None or source_id is None or len(embedding) != self._vectors.shape[1]:
+            return None
+        
+        query = np.asarray(embedding, dtype=np.float32)
+        scores = self._vectors @ query / (np.linalg.norm(query) or 1.0)
+        scores[self._source_ids != source_id] = -np.inf
+        
+        slot = int(np.argmax(scores))
+        if scores[slot] < self.threshold:
+            return None
+        self._lru.move_to_end(slot)
+        return self._results[slot]
+    
+    def put(self, embedding: List[float], source: Optional[str], results: List[Dict[str, Any]]):
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_size, len(embedding)), dtype=np.float32)
+        elif len(embedding) != self._vectors.shape[1]:
+            return
+        
+        # Fill free slots first, then reuse the least recently used one
+        if len(self._lru) < self.max_size:
+            slot = len(self._lru)
+        else:
+            slot, _ = self._lru.popitem(last=False)
+        
+        vector = np.asarray(embedding, dtype=np.float32)
+        # Store unit vectors so lookups only need the query's norm
+        self._vectors[slot] = vector / (np.linalg.norm(vector) or 1.0)
+        self._source_ids[slot] = self._sources.setdefault(source, len(self._sources))
+        self._results[slot] = results
+        self._lru[slot] = None
+
+search_cache = LRUCache(SEARCH_CACHE_SIZE)
+# Merged raw/preprocessed results, kept apart from single-search results
+context_cache = LRUCache(SEARCH_CACHE_SIZE)
+semantic_cache = SemanticCache(SEARCH_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD)
+
 async def search_documents(query: str, source: str = None) -> List[Dict[str, Any]]:
     """Search for relevant documents using vector similarity."""
-    # Get query embedding
-    query_embedding = await openai_client.embeddings.create(
-        model="text-embedding-ada-002",
-        input=query
-    )
+    cached = search_cache.get((query, source))
+    if cached is not None:
+        return cached
+    
+    # Get query embedding from the same backend used at ingest time
+    query_embedding = await get_embedding(query)
+    
+    results = await search_by_embedding(query_embedding, source)
+    search_cache.put((query, source), results)
+    return results
+
+async def search_by_embedding(query_embedding: List[float], source: str = None) -> List[Dict[str, Any]]:
+    """Search for the documents closest to a query embedding."""
+    # Reuse results for near-duplicate queries
+    cached = semantic_cache.get(query_embedding, source)
+    if cached is not None:
+        return cached
     
     # Search in Supabase
-    query_params = {"query_embedding": query_embedding.data[0].embedding, "match_count": 5}
+    query_params = {"query_embedding": query_embedding, "match_count": MATCH_COUNT}
     if source:
         query_params["source"] = source
     
-    result = supabase.rpc(
+    result = await get_postgrest_client().rpc(
         "match_site_pages",
         query_params
     ).execute()
     
+    semantic_cache.put(query_embedding, source, result.data)
     return result.data
 
+def merge_results(*results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merge several searches into one list of the best distinct documents."""
+    merged = {}
+    for docs in results:
+        for doc in docs:
+            merged.setdefault(doc.get("id", (doc["url"], doc["content"])), doc)
+    
+    ranked = sorted(merged.values(), key=lambda doc: doc.get("similarity", 0), reverse=True)
+    return ranked[:MATCH_COUNT]
+
 async def generate_response(query: str, context: List[Dict[str, Any]]) -> str:
     """Generate a response using the query and retrieved context."""
     # Prepare context string
@@ -83,7 +191,7 @@ async def generate_response(query: str, context: List[Dict[str, Any]]) -> str:
     If you're not sure about something, say so rather than making assumptions.
     """
     
-    response = await openai_client.chat.completions.create(
+    response = await get_openai().chat.completions.create(
         model=os.getenv("LLM_MODEL", "gpt-4"),
         messages=[
             {"role": "system", "content": system_prompt},
@@ -94,15 +202,37 @@ async def generate_response(query: str, context: List[Dict[str, Any]]) -> str:
     
     return response.choices[0].message.content
 
+async def retrieve_context(query: str, source: str = None) -> List[Dict[str, Any]]:
+    """Find context for a query using both its raw and preprocessed forms."""
+    # Repeated queries skip preprocessing and embedding entirely
+    cached = context_cache.get((query, source))
+    if cached is not None:
+        return cached
+    
+    # Embed the raw query while the query is being preprocessed
+    raw_embedding_task = asyncio.create_task(get_embedding(query))
+    try:
+        enhanced_query = await preprocess_query(query)
+        enhanced_embedding = await get_embedding(enhanced_query)
+        raw_embedding = await raw_embedding_task
+    finally:
+        raw_embedding_task.cancel()
+    
+    # Search with both embeddings at once
+    enhanced_results, raw_results = await asyncio.gather(
+        search_by_embedding(enhanced_embedding, source),
+        search_by_embedding(raw_embedding, source)
+    )
+    context = merge_results(enhanced_results, raw_results)
+    context_cache.put((query, source), context)
+    return context
+
 async def run(query: str, context_type: str = "docs") -> str:
     """Run the RAG pipeline on a query."""
     try:
-        # Preprocess query
-        enhanced_query = await preprocess_query(query)
-        
         # Search for relevant documents
         source = "pydantic_ai_docs" if context_type == "docs" else None
-        context = await search_documents(enhanced_query, source)
+        context = await retrieve_context(query, source)
         
         # Generate response
         response = await generate_response(query, context)